@@ -1,28 +1,37 @@
 import sys
 import os
 import json
+import argparse
 import math
-import win32gui
-import win32con
 import time
-import win32api
-import win32process
 import ctypes
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import wintypes
 import keyboard
 import psutil
+try:
+    import win32gui
+    import win32con
+    import win32api
+    import win32process
+except ImportError:
+    # 非 Windows 平台（如 CI 中跑 soak.py）只能配合假后端使用
+    win32gui = win32con = win32api = win32process = None
 from PyQt6.QtWidgets import (QApplication, QListWidget, QListWidgetItem,
                              QVBoxLayout, QWidget, QStyle, QDialog, QFormLayout,
                              QSystemTrayIcon, QMenu, QStyledItemDelegate, QFileIconProvider,
                              QPushButton, QColorDialog, QSlider, QSpinBox, QRadioButton, QButtonGroup, QHBoxLayout,
-                             QLabel, QFrame, QStyleOption)
-from PyQt6.QtCore import Qt, QSize, pyqtSignal, QFileInfo, QRect, QTimer
-from PyQt6.QtGui import QIcon, QAction, QColor, QPainter
+                             QLabel, QFrame, QStyleOption, QCheckBox)
+from PyQt6.QtCore import Qt, QSize, pyqtSignal, QFileInfo, QRect, QTimer, QPointF
+from PyQt6.QtGui import QIcon, QAction, QColor, QPainter, QCursor
 
 
-user32 = ctypes.windll.user32
-# DWM API
-dwmapi = ctypes.WinDLL("dwmapi")
+if sys.platform == "win32":
+    user32 = ctypes.windll.user32
+    # DWM API
+    dwmapi = ctypes.WinDLL("dwmapi")
+else:
+    user32 = dwmapi = None
 DWMWA_CLOAKED = 14
 
 # SystemParametersInfo 常量，用于解决切换焦点时的 LockTimeout 问题
@@ -40,6 +49,27 @@ def is_window_cloaked(hwnd):
         pass
     return False
 
+def collect_windows(backend, exclude, known_pids, is_cancelled=lambda: False):
+    """
+    枚举窗口并查询 pid 和程序路径，供 Alt 按下时的后台预取使用。
+    已有图标的进程 (known_pids) 不再查程序路径；is_cancelled() 为真时提前返回已收集的部分。
+    返回 [(hwnd, title, pid, exe_path), ...]。
+    """
+    windows = []
+    for hwnd, title in backend.enum_windows(exclude):
+        if is_cancelled():
+            break
+        pid = exe_path = None
+        try:
+            pid = backend.get_window_pid(hwnd)
+            if pid not in known_pids:
+                exe_path = backend.get_process_path(pid)
+        except:
+            pass
+        windows.append((hwnd, title, pid, exe_path))
+    return windows
+
+
 def get_recourse_path(filename):
     if getattr(sys, 'frozen', False):
         base_path = sys._MEIPASS
@@ -56,7 +86,10 @@ class ConfigManager:
             "sel_bg_color": "#cce8ff",
             "opacity": 1.0,
             "layout_mode": "grid",
-            "max_items": 6
+            "max_items": 6,
+            "keep_realized": False,
+            "speculative_prefetch": True,
+            "prefetch_window_ms": 500
         }
         self.settings = self.load_settings()
 
@@ -91,10 +124,53 @@ class UniversalDelegate(QStyledItemDelegate):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.mode = CONFIG.get("layout_mode")
+        # (icon.cacheKey(), 图标尺寸, devicePixelRatio) -> QPixmap
+        # 避免 QIcon.paint 每次绘制都重新缩放
+        self.pixmap_cache = {}
+        # 绘制和预热共用同一个 DPR，取自切换器将要显示的目标屏幕，
+        # 而不是绘制设备（常驻模式停放在屏幕外时两者可能不同）
+        self.dpr = QApplication.primaryScreen().devicePixelRatio()
 
     def update_mode(self):
         self.mode = CONFIG.get("layout_mode")
 
+    def icon_size(self):
+        return 32 if self.mode == "list" else 48
+
+    def icon_pixmap(self, icon):
+        size = self.icon_size()
+        key = (icon.cacheKey(), size, self.dpr)
+        pixmap = self.pixmap_cache.get(key)
+        if pixmap is None:
+            # QIcon.pixmap 可能返回比要求小的图（比如 48px 的图标在 150% 屏幕上要 72px），
+            # 在这里一次性缩放到正好 size * dpr 个物理像素，绘制时就不用再缩放
+            px = round(size * self.dpr)
+            pixmap = icon.pixmap(QSize(size, size), self.dpr)
+            if max(pixmap.width(), pixmap.height()) != px:
+                pixmap = pixmap.scaled(px, px, Qt.AspectRatioMode.KeepAspectRatio,
+                                       Qt.TransformationMode.SmoothTransformation)
+            pixmap.setDevicePixelRatio(self.dpr)
+            self.pixmap_cache[key] = pixmap
+        return pixmap
+
+    def warm_pixmaps(self, icons, dpr):
+        """按目标屏幕的 DPR 预先生成图标，同时丢掉不再使用的图标"""
+        self.dpr = dpr
+        keys = {icon.cacheKey() for icon in icons}
+        for key in list(self.pixmap_cache):
+            if key[0] not in keys:
+                del self.pixmap_cache[key]
+        for icon in icons:
+            self.icon_pixmap(icon)
+
+    def draw_icon(self, painter, icon_rect, icon):
+        """按原始物理尺寸画在 icon_rect 中央，不经过缩放"""
+        pixmap = self.icon_pixmap(icon)
+        size = pixmap.deviceIndependentSize()
+        x = icon_rect.x() + (icon_rect.width() - size.width()) / 2
+        y = icon_rect.y() + (icon_rect.height() - size.height()) / 2
+        painter.drawPixmap(QPointF(x, y), pixmap)
+
     def paint(self, painter, option, index):
         painter.save()
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
@@ -118,7 +194,7 @@ class UniversalDelegate(QStyledItemDelegate):
         font.setFamily("Microsoft YaHei UI")
 
         if self.mode == "list":
-            icon_size = 32
+            icon_size = self.icon_size()
             padding = 15
 
             # 垂直居中
@@ -127,7 +203,7 @@ class UniversalDelegate(QStyledItemDelegate):
             # 图标
             icon_rect = QRect(option.rect.left() + padding, cy - icon_size // 2, icon_size, icon_size)
             if icon:
-                icon.paint(painter, icon_rect)
+                self.draw_icon(painter, icon_rect, icon)
 
             # 文字
             text_rect = QRect(icon_rect.right() + padding, option.rect.top(),
@@ -140,14 +216,14 @@ class UniversalDelegate(QStyledItemDelegate):
             painter.drawText(text_rect, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, elided_text)
 
         else:  # grid
-            icon_size = 48
+            icon_size = self.icon_size()
             # 图标居中，稍微偏上
             icon_x = option.rect.left() + (option.rect.width() - icon_size) // 2
             icon_y = option.rect.top() + 15
             icon_rect = QRect(int(icon_x), int(icon_y), icon_size, icon_size)
 
             if icon:
-                icon.paint(painter, icon_rect)
+                self.draw_icon(painter, icon_rect, icon)
 
             # 文字在下方
             text_rect = QRect(option.rect.left() + 4, icon_rect.bottom() + 8,
@@ -299,6 +375,13 @@ class SettingsDialog(QDialog):
         self.spin_max.setToolTip("列表模式为最大行数，网格模式为每行个数")
         form_layout.addRow("显示阈值:", self.spin_max)
 
+        # 5. 常驻窗口
+        self.check_realized = QCheckBox("隐藏时保留窗口")
+        self.check_realized.setChecked(CONFIG.get("keep_realized"))
+        self.check_realized.toggled.connect(lambda v: self.save_val("keep_realized", v))
+        self.check_realized.setToolTip("窗口隐藏时只是透明并移出屏幕，呼出更快，但会常驻少量显存")
+        form_layout.addRow("常驻窗口:", self.check_realized)
+
         layout.addLayout(form_layout)
 
         # 底部说明
@@ -354,27 +437,189 @@ class SettingsDialog(QDialog):
 
 
 # ==========================================
-# 4. 主窗口
+# 4. 系统后端
+# ==========================================
+class Win32Backend:
+    """
+    所有与 Windows / 键盘钩子打交道的调用都集中在这里，
+    WindowSwitcher 只通过这个接口取数据，方便用假后端做 soak / 回放测试。
+    """
+
+    # switch_to_window 会模拟一次 Alt，之后这段时间内的 Alt 按下不当作用户按键，
+    # 以免每次切换都触发一次白费的预取。
+    # 钩子不一定能收到这次模拟按键（keyboard 库会丢弃部分注入事件），所以不计数，
+    # 只看时间：收不到时唯一的影响是激活后 100ms 内用户真按下的 Alt 不会触发预取，Tab 照常工作。
+    INJECTED_ALT_MS = 100
+
+    def __init__(self):
+        self.ignore_alt_until = 0.0
+
+    def install_hooks(self, on_tab, on_alt_release, on_alt_press):
+        """挂载键盘钩子"""
+        # 先卸载所有旧钩子，防止重复
+        keyboard.unhook_all()
+
+        # 重新挂载
+        keyboard.add_hotkey('alt+tab', on_tab, suppress=True)
+        keyboard.on_release_key('alt', on_alt_release)
+        keyboard.on_press_key('alt', lambda e: self.on_alt_press(e, on_alt_press))
+
+    def on_alt_press(self, e, callback):
+        if time.perf_counter() < self.ignore_alt_until:
+            return
+        callback(e)
+
+    def enum_windows(self, exclude=()):
+        """返回可切换窗口的 [(hwnd, title), ...]，顺序即 Z 序"""
+        exclude = {int(h) for h in exclude}
+        windows = []
+
+        def enum_handler(hwnd, ctx):
+            if win32gui.IsWindowVisible(hwnd) and not is_window_cloaked(hwnd):
+                title = win32gui.GetWindowText(hwnd)
+                # 过滤掉一些特定窗口
+                if title and title != "Program Manager":
+                    style = win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE)
+                    if not (style & win32con.WS_EX_TOOLWINDOW) or (style & win32con.WS_EX_APPWINDOW):
+                        if int(hwnd) not in exclude:
+                            windows.append((hwnd, title))
+
+        win32gui.EnumWindows(enum_handler, None)
+        return windows
+
+    def get_window_pid(self, hwnd):
+        _, pid = win32process.GetWindowThreadProcessId(hwnd)
+        return pid
+
+    def get_process_path(self, pid):
+        return psutil.Process(pid).exe()
+
+    def snapshot_windows(self, exclude, known_pids, tag, is_cancelled):
+        """预取用的一次性快照，tag 是预取的代号，录制时用来把结果对应回那次预取"""
+        return collect_windows(self, exclude, known_pids, is_cancelled)
+
+    def switch_to_window(self, hwnd):
+        """
+        核弹级切换窗口：
+        1. 模拟按键骗过 Windows 的焦点保护机制。
+        2. 处理最小化窗口还原。
+        3. 强制夺取前台权限。
+        目标窗口已经不存在时返回 False。
+        """
+        try:
+            hwnd = int(hwnd)
+            if not win32gui.IsWindow(hwnd):
+                return False
+
+            # 1. 如果窗口被最小化了，先还原
+            # 使用 SW_RESTORE 可以还原最小化的窗口，SW_SHOW 只是显示
+            if win32gui.IsIconic(hwnd):
+                win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+            else:
+                win32gui.ShowWindow(hwnd, win32con.SW_SHOW)
+
+            # 2. 【核心黑科技】模拟按下并松开 Alt 键 (VK_MENU = 0x12)
+            # 这会欺骗 Windows 认为有物理输入，从而允许当前进程更改前台窗口
+            # 0 = KEYEVENTF_EXTENDEDKEY | 0
+            # 2 = KEYEVENTF_KEYUP
+            self.ignore_alt_until = time.perf_counter() + self.INJECTED_ALT_MS / 1000
+            user32.keybd_event(0x12, 0, 0, 0)  # Press Alt
+            user32.keybd_event(0x12, 0, 2, 0)  # Release Alt
+
+            # 3. 常规切换尝试
+            win32gui.SetForegroundWindow(hwnd)
+            win32gui.SetFocus(hwnd)
+
+        except Exception as e:
+            # print(f"Standard switch failed: {e}, trying brute force...")
+
+            # 4. 如果常规方法失败（通常是 Access Denied），启动暴力模式
+            try:
+                # 获取当前前台窗口的线程和目标窗口的线程
+                foreground_hwnd = win32gui.GetForegroundWindow()
+                curr_tid = win32api.GetCurrentThreadId()
+                fore_tid, _ = win32process.GetWindowThreadProcessId(foreground_hwnd)
+                target_tid, _ = win32process.GetWindowThreadProcessId(hwnd)
+
+                # 将我们的线程“附着”到前台窗口线程上，共享输入队列
+                win32process.AttachThreadInput(curr_tid, fore_tid, True)
+                if target_tid != fore_tid:
+                    win32process.AttachThreadInput(curr_tid, target_tid, True)
+
+                # 再次尝试设置前台
+                win32gui.SetForegroundWindow(hwnd)
+                win32gui.BringWindowToTop(hwnd)
+
+                # 解除附着
+                win32process.AttachThreadInput(curr_tid, fore_tid, False)
+                if target_tid != fore_tid:
+                    win32process.AttachThreadInput(curr_tid, target_tid, False)
+
+            except:
+                # 5. 最后的救命稻草：SwitchToThisWindow
+                # 这是个未公开/过时的 API，但在 Win10/11 上对顽固窗口非常有效
+                try:
+                    user32.SwitchToThisWindow(hwnd, True)
+                except:
+                    pass
+        return True
+
+
+# ==========================================
+# 5. 主窗口
 # ==========================================
 class WindowSwitcher(QWidget):
     sig_show = pyqtSignal()
     sig_next = pyqtSignal()
     sig_activate = pyqtSignal()
+    sig_tab = pyqtSignal(float)
+    sig_release = pyqtSignal()
+    sig_prefetch = pyqtSignal(float)
+    sig_prefetch_ready = pyqtSignal(int)
 
-    def __init__(self):
+    def __init__(self, backend=None, clock=time.perf_counter):
         super().__init__()
+        self.backend = backend or Win32Backend()
+        # 热键时间戳的来源（秒），回放时由 trace 里的时间驱动，预取是否过期的判断才可复现
+        self.clock = clock
 
         # Tool 属性确保不显示在任务栏
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint | Qt.WindowType.Tool)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
 
         self.icon_cache = {}
+        self.stale_icon_cache = {}
         self.icon_provider = QFileIconProvider()
-
+        self.settings_dlg = None
+
+        # 切换器是否处于呼出状态；常驻模式下窗口一直 visible，不能再用 isVisible 判断
+        self.shown = False
+        self.parked = False
+        self.target_geometry = QRect()
+
+        # 按屏幕缓存的窗口几何：(屏幕, DPR, 布局, 阈值, 数量) -> QRect
+        # 只在屏幕增删 / DPI 变化时清空
+        self.layout_cache = {}
+        self.target_screen = QApplication.primaryScreen()
+        self.watch_screens()
+
+        # 按下 Alt 时在后台线程预取窗口列表，Tab 及时到来就直接使用
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_future = None
+        self.prefetch_started = 0.0
+        self.prefetch_generation = 0
+        self.prefetch_ready_generation = -1
+        self.prefetch_ready_ms = 0.0
+        self.cancelled_prefetches = {}  # generation -> future，完成后计入浪费的耗时
+        self.prefetch_stats = {"started": 0, "hits": 0, "stale": 0, "cancelled": 0, "wasted_ms": 0.0}
 
         self.sig_show.connect(self.show_switcher)
         self.sig_next.connect(self.select_next)
         self.sig_activate.connect(self.activate_selected)
+        self.sig_prefetch.connect(self.start_prefetch)
+        self.sig_tab.connect(self.on_tab)
+        self.sig_release.connect(self.on_release)
+        self.sig_prefetch_ready.connect(self.on_prefetch_ready)
 
         # 1. 开启心跳定时器 (防止进程被系统挂起)
         self.heartbeat_timer = QTimer(self)
@@ -421,12 +666,7 @@ class WindowSwitcher(QWidget):
     def setup_hooks(self):
         """挂载键盘钩子"""
         try:
-            # 先卸载所有旧钩子，防止重复
-            keyboard.unhook_all()
-
-            # 重新挂载
-            keyboard.add_hotkey('alt+tab', self.on_hotkey_tab, suppress=True)
-            keyboard.on_release_key('alt', self.on_hotkey_release)
+            self.backend.install_hooks(self.on_hotkey_tab, self.on_hotkey_release, self.on_hotkey_alt_press)
             print(f"Hooks installed/refreshed at {time.strftime('%H:%M:%S')}")
         except Exception as e:
             print(f"Hook Error: {e}")
@@ -436,15 +676,30 @@ class WindowSwitcher(QWidget):
         # print("Watchdog: Refreshing hooks...")
         self.setup_hooks()
 
+    # 钩子回调运行在键盘钩子线程，只负责转发；呼出 / 切换 / 激活的判断放在 GUI 线程，
+    # 否则快速连按时钩子线程读到的 shown 还是旧值，第二次 Tab 或松开 Alt 会被丢掉
+
     def on_hotkey_tab(self):
-        if not self.isVisible():
-            self.sig_show.emit()
-        else:
-            self.sig_next.emit()
+        self.sig_tab.emit(self.clock())
 
     def on_hotkey_release(self, e):
-        if self.isVisible():
-            self.sig_activate.emit()
+        self.sig_release.emit()
+
+    def on_hotkey_alt_press(self, e):
+        self.sig_prefetch.emit(self.clock())
+
+    def on_tab(self, pressed_at):
+        if not self.shown:
+            self.show_switcher(pressed_at)
+        else:
+            self.select_next()
+
+    def on_release(self):
+        if self.shown:
+            self.activate_selected()
+        else:
+            # 只按了 Alt 没有按 Tab，丢弃预取结果
+            self.cancel_prefetch("cancelled")
 
     def apply_settings(self):
         bg = CONFIG.get("bg_color")
@@ -485,6 +740,31 @@ class WindowSwitcher(QWidget):
             self.list_widget.setSpacing(2)
 
         self.list_widget.update()
+        self.apply_realized_mode()
+
+    def apply_realized_mode(self):
+        """
+        常驻模式：隐藏时不调用 hide()，而是把窗口透明并移到屏幕外，
+        原生窗口和 backing store 一直保留，呼出时只需改位置和透明度。
+        """
+        if self.shown: return
+        if CONFIG.get("keep_realized"):
+            self.park()
+            if not self.isVisible():
+                self.show()
+        elif self.parked:
+            self.unpark()
+
+    def park(self):
+        self.parked = True
+        self.setWindowOpacity(0.0)
+        # 移到所有屏幕之外，避免透明的置顶窗口挡住鼠标
+        self.move(-32000, -32000)
+
+    def unpark(self):
+        self.parked = False
+        self.hide()
+        self.setWindowOpacity(CONFIG.get("opacity"))
 
     def paintEvent(self, event):
         """
@@ -500,10 +780,14 @@ class WindowSwitcher(QWidget):
         self.style().drawPrimitive(QStyle.PrimitiveElement.PE_Widget, opt, p, self)
 
     def open_settings(self):
-        self.settings_dlg = SettingsDialog(self)
-        self.settings_dlg.setWindowFlags(Qt.WindowType.Window)
-        self.settings_dlg.settings_changed.connect(self.apply_settings)
+        # 复用同一个设置窗口，避免每次打开都新建一个 QDialog 挂在 self 下面
+        if self.settings_dlg is None:
+            self.settings_dlg = SettingsDialog(self)
+            self.settings_dlg.setWindowFlags(Qt.WindowType.Window)
+            self.settings_dlg.settings_changed.connect(self.apply_settings)
         self.settings_dlg.show()
+        self.settings_dlg.raise_()
+        self.settings_dlg.activateWindow()
 
     def init_tray_icon(self):
         self.tray_icon = QSystemTrayIcon(self)
@@ -527,14 +811,20 @@ class WindowSwitcher(QWidget):
 
     def quit_app(self):
         self.tray_icon.hide()
+        self.prefetch_executor.shutdown(wait=False, cancel_futures=True)
         QApplication.quit()
 
-    def get_window_icon(self, hwnd):
+    def get_window_icon(self, hwnd, pid=None, exe_path=None):
+        """pid / exe_path 可由预取结果传入，省去重复查询"""
         try:
-            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            if pid is None:
+                pid = self.backend.get_window_pid(hwnd)
             if pid in self.icon_cache: return self.icon_cache[pid]
-            process = psutil.Process(pid)
-            exe_path = process.exe()
+            if pid in self.stale_icon_cache:
+                icon = self.icon_cache[pid] = self.stale_icon_cache[pid]
+                return icon
+            if exe_path is None:
+                exe_path = self.backend.get_process_path(pid)
             if os.path.exists(exe_path):
                 icon = self.icon_provider.icon(QFileInfo(exe_path))
                 self.icon_cache[pid] = icon
@@ -543,28 +833,150 @@ class WindowSwitcher(QWidget):
             pass
         return self.style().standardIcon(QStyle.StandardPixmap.SP_FileIcon)
 
-    def refresh_windows(self):
+    def watch_screens(self):
+        app = QApplication.instance()
+        app.screenAdded.connect(self.on_screen_added)
+        app.screenRemoved.connect(lambda screen: self.invalidate_screen_caches())
+        app.primaryScreenChanged.connect(lambda screen: self.invalidate_screen_caches())
+        for screen in app.screens():
+            self.on_screen_added(screen, invalidate=False)
+
+    def on_screen_added(self, screen, invalidate=True):
+        screen.geometryChanged.connect(self.invalidate_screen_caches)
+        screen.availableGeometryChanged.connect(self.invalidate_screen_caches)
+        screen.logicalDotsPerInchChanged.connect(self.invalidate_screen_caches)
+        screen.physicalDotsPerInchChanged.connect(self.invalidate_screen_caches)
+        if invalidate:
+            self.invalidate_screen_caches()
+
+    def invalidate_screen_caches(self, *args):
+        self.layout_cache.clear()
+        self.delegate.pixmap_cache.clear()
+
+    def active_screen(self):
+        """切换器显示在鼠标所在的屏幕上，找不到时退回主屏幕"""
+        return QApplication.screenAt(QCursor.pos()) or QApplication.primaryScreen()
+
+    def excluded_windows(self):
+        exclude = [self.winId()]
+        if self.settings_dlg is not None and self.settings_dlg.isVisible():
+            exclude.append(self.settings_dlg.winId())
+        return exclude
+
+    # --- Alt 按下时的预取 ---
+
+    def start_prefetch(self, pressed_at):
+        """
+        sig_prefetch 的槽，在 GUI 线程中执行，pressed_at 是 Alt 按下的时间戳。
+        按住 Alt 时键盘会自动重复，已有进行中的预取就直接忽略。
+        """
+        if self.prefetch_future is not None or self.shown or not CONFIG.get("speculative_prefetch"):
+            return
+
+        self.prefetch_generation += 1
+        self.prefetch_started = pressed_at
+        self.prefetch_stats["started"] += 1
+        generation = self.prefetch_generation
+        self.prefetch_future = self.prefetch_executor.submit(
+            self.prefetch_windows, generation, self.excluded_windows(), set(self.icon_cache))
+        self.prefetch_future.add_done_callback(lambda f: self.sig_prefetch_ready.emit(generation))
+
+    def prefetch_windows(self, generation, exclude, known_pids):
+        """
+        后台线程：拿一份窗口快照（psutil 查程序路径是最慢的部分）。
+        返回 ([(hwnd, title, pid, exe_path), ...], 耗时毫秒)，失败时列表为 None。
+        图标必须在 GUI 线程创建，这里只准备路径。
+        """
+        t0 = time.perf_counter()
+        try:
+            windows = self.backend.snapshot_windows(
+                exclude, known_pids, generation, lambda: generation != self.prefetch_generation)
+        except Exception as e:
+            print(f"Prefetch Error: {e}")
+            windows = None
+        return windows, (time.perf_counter() - t0) * 1000
+
+    def on_prefetch_ready(self, generation):
+        """
+        预取完成：在 GUI 线程提前建好列表（图标、DPR 图标缓存、窗口几何），
+        Tab 到来时只剩显示。
+        """
+        future = self.cancelled_prefetches.pop(generation, None)
+        if future is not None:
+            self.prefetch_stats["wasted_ms"] += future.result()[1]
+            return
+        if generation != self.prefetch_generation or self.prefetch_future is None:
+            return  # 已经被 show_switcher 用掉了，或者在排队时就被取消了
+
+        windows, elapsed = self.prefetch_future.result()
+        if windows is None: return
+
+        t0 = time.perf_counter()
+        self.refresh_windows(windows)
+        self.prefetch_ready_generation = generation
+        self.prefetch_ready_ms = elapsed + (time.perf_counter() - t0) * 1000
+
+    def cancel_prefetch(self, reason):
+        future = self.prefetch_future
+        if future is None: return
+        self.prefetch_future = None
+        self.prefetch_stats[reason] += 1
+        if self.prefetch_ready_generation == self.prefetch_generation:
+            # 结果已经处理过，不会再有完成信号，直接记账
+            self.prefetch_stats["wasted_ms"] += self.prefetch_ready_ms
+        elif not future.cancel():
+            # 后台线程已经在跑，等它的完成信号再把耗时计入浪费
+            self.cancelled_prefetches[self.prefetch_generation] = future
+        self.prefetch_generation += 1  # 让后台线程提前退出
+
+    def commit_prefetch(self, pressed_at):
+        """
+        Tab 到来时提交预取结果，返回列表是否已经就绪。
+        Alt 与 Tab 按下的间隔超过时间窗口时结果已经不可信，直接丢弃。
+        只比较两个按键时间戳，不看处理时刻，录制和回放的判断才会一致。
+        """
+        if self.prefetch_future is None:
+            return False
+        if (pressed_at - self.prefetch_started) * 1000 > CONFIG.get("prefetch_window_ms"):
+            self.cancel_prefetch("stale")
+            return False
+
+        future = self.prefetch_future
+        self.prefetch_future = None
+        if self.prefetch_ready_generation != self.prefetch_generation:
+            # 后台线程可能还没跑完，等它即可，这部分工作本来就要做
+            windows, _ = future.result()
+            if windows is None:
+                return False
+            self.refresh_windows(windows)
+        self.prefetch_stats["hits"] += 1
+        return True
+
+    def refresh_windows(self, prefetched=None):
         self.list_widget.clear()
+        self.target_screen = self.active_screen()
+
+        # icon_cache 以 pid 为键，每次刷新都重建一遍，只留下仍在列表里的进程，
+        # 否则长时间运行后退出进程的 pid 会一直堆在缓存里
+        self.stale_icon_cache, self.icon_cache = self.icon_cache, {}
+        if prefetched is not None:
+            for hwnd, title, pid, exe_path in prefetched:
+                self.add_window_item(hwnd, title, pid, exe_path)
+        else:
+            for hwnd, title in self.backend.enum_windows(self.excluded_windows()):
+                self.add_window_item(hwnd, title)
+        self.stale_icon_cache = {}
 
-        def enum_handler(hwnd, ctx):
-            if win32gui.IsWindowVisible(hwnd) and not is_window_cloaked(hwnd):
-                title = win32gui.GetWindowText(hwnd)
-                # 过滤掉一些特定窗口
-                if title and title != "Program Manager":
-                    style = win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE)
-                    if not (style & win32con.WS_EX_TOOLWINDOW) or (style & win32con.WS_EX_APPWINDOW):
-                        if int(hwnd) != int(self.winId()):
-                            if hasattr(self, 'settings_dlg') and self.settings_dlg.isVisible():
-                                if int(hwnd) == int(self.settings_dlg.winId()): return
-                            self.add_window_item(hwnd, title)
+        icons = [self.list_widget.item(row).data(Qt.ItemDataRole.DecorationRole)
+                 for row in range(self.list_widget.count())]
+        self.delegate.warm_pixmaps(icons, self.target_screen.devicePixelRatio())
 
-        win32gui.EnumWindows(enum_handler, None)
         self.adjust_window_size()
 
-    def add_window_item(self, hwnd, title):
+    def add_window_item(self, hwnd, title, pid=None, exe_path=None):
         item = QListWidgetItem()
         item.setData(Qt.ItemDataRole.DisplayRole, title)
-        item.setData(Qt.ItemDataRole.DecorationRole, self.get_window_icon(hwnd))
+        item.setData(Qt.ItemDataRole.DecorationRole, self.get_window_icon(hwnd, pid, exe_path))
         item.setData(Qt.ItemDataRole.UserRole, hwnd)
         item.setToolTip(title)
 
@@ -585,9 +997,28 @@ class WindowSwitcher(QWidget):
         count = self.list_widget.count()
         if count == 0: return
 
+        geometry = self.window_geometry(count, self.target_screen)
+        self.target_geometry = geometry
+
+        if self.parked:
+            # 停放时只调整大小，保证 backing store 尺寸正确，位置在呼出时再移回来
+            if self.size() != geometry.size():
+                self.resize(geometry.size())
+        elif self.geometry() != geometry:
+            self.setGeometry(geometry)
+
+    def window_geometry(self, count, screen):
+        # 同一屏幕、同一 DPR 下几何只算一次，缓存命中且位置没变时不触发原生窗口重排
         max_items = CONFIG.get("max_items")
         layout_mode = CONFIG.get("layout_mode")
-
+        key = (screen.name(), screen.devicePixelRatio(), layout_mode, max_items, count)
+        geometry = self.layout_cache.get(key)
+        if geometry is None:
+            geometry = self.compute_geometry(count, layout_mode, max_items, screen)
+            self.layout_cache[key] = geometry
+        return geometry
+
+    def compute_geometry(self, count, layout_mode, max_items, screen):
         # 获取边距 (假设我们在 apply_settings 里设置了 margin)
         m_left, m_top, m_right, m_bottom = 10, 10, 10, 10
 
@@ -597,8 +1028,8 @@ class WindowSwitcher(QWidget):
             spacing = 2
 
             # 高度 = 数量 * (高度 + 间距) + 上下边距
+            total_w = 360
             total_h = count * (item_height + spacing) + m_top + m_bottom
-            self.resize(360, total_h)
 
         else:
             # --- 网格模式 (Win10) ---
@@ -623,30 +1054,40 @@ class WindowSwitcher(QWidget):
             # 高度 = 行数 * (块高 + 间距) + 上下边距
             total_h = rows * (item_h + spacing) + m_top + m_bottom
 
-            self.resize(total_w, total_h)
-
-        self.center_window()
-
-    def center_window(self):
-        qr = self.frameGeometry()
-        screen = QApplication.primaryScreen()
-        cp = screen.availableGeometry().center()
-        qr.moveCenter(cp)
-        self.move(qr.topLeft())
+        # 居中到目标屏幕的可用区域
+        qr = QRect(0, 0, total_w, total_h)
+        qr.moveCenter(screen.availableGeometry().center())
+        return qr
 
     # --- 显示与切换逻辑 ---
 
-    def show_switcher(self):
-        if not self.isVisible():
-            self.refresh_windows()
+    def show_switcher(self, pressed_at=None):
+        if not self.shown:
+            if pressed_at is None:
+                pressed_at = self.clock()
+            if not self.commit_prefetch(pressed_at):
+                self.refresh_windows()
 
             # 选中第二个（通常是上一个活动窗口），如果是列表末尾则选第0个
             target = 1 if self.list_widget.count() > 1 else 0
             self.list_widget.setCurrentRow(target)
 
-            self.show()
+            self.shown = True
+            if self.parked:
+                self.parked = False
+                self.move(self.target_geometry.topLeft())
+                self.setWindowOpacity(CONFIG.get("opacity"))
+            else:
+                self.show()
             self.activateWindow()
 
+    def hide_switcher(self):
+        self.shown = False
+        if CONFIG.get("keep_realized"):
+            self.park()
+        else:
+            self.hide()
+
     def select_next(self):
         if self.list_widget.count() == 0: return
         current = self.list_widget.currentRow()
@@ -654,75 +1095,21 @@ class WindowSwitcher(QWidget):
         self.list_widget.setCurrentRow(next_row)
 
     def activate_selected(self):
-        if not self.isVisible(): return
+        if not self.shown: return
         item = self.list_widget.currentItem()
-        self.hide()
+        self.hide_switcher()
+        switched = False
         if item:
             hwnd = item.data(Qt.ItemDataRole.UserRole)
-            self.switch_to_window(hwnd)
+            switched = self.switch_to_window(hwnd)
+        if not switched and self.parked:
+            # 没有切走（列表为空或目标窗口已关闭）时，停放的透明窗口仍是前台窗口，
+            # 会吞掉键盘输入。退回真正的 hide()，让系统激活 Z 序里的下一个窗口，
+            # 下次呼出走 show()，再隐藏时重新停放
+            self.unpark()
 
     def switch_to_window(self, hwnd):
-        """
-        核弹级切换窗口：
-        1. 模拟按键骗过 Windows 的焦点保护机制。
-        2. 处理最小化窗口还原。
-        3. 强制夺取前台权限。
-        """
-        try:
-            hwnd = int(hwnd)
-            if not win32gui.IsWindow(hwnd):
-                return
-
-            # 1. 如果窗口被最小化了，先还原
-            # 使用 SW_RESTORE 可以还原最小化的窗口，SW_SHOW 只是显示
-            if win32gui.IsIconic(hwnd):
-                win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
-            else:
-                win32gui.ShowWindow(hwnd, win32con.SW_SHOW)
-
-            # 2. 【核心黑科技】模拟按下并松开 Alt 键 (VK_MENU = 0x12)
-            # 这会欺骗 Windows 认为有物理输入，从而允许当前进程更改前台窗口
-            # 0 = KEYEVENTF_EXTENDEDKEY | 0
-            # 2 = KEYEVENTF_KEYUP
-            user32.keybd_event(0x12, 0, 0, 0)  # Press Alt
-            user32.keybd_event(0x12, 0, 2, 0)  # Release Alt
-
-            # 3. 常规切换尝试
-            win32gui.SetForegroundWindow(hwnd)
-            win32gui.SetFocus(hwnd)
-
-        except Exception as e:
-            # print(f"Standard switch failed: {e}, trying brute force...")
-
-            # 4. 如果常规方法失败（通常是 Access Denied），启动暴力模式
-            try:
-                # 获取当前前台窗口的线程和目标窗口的线程
-                foreground_hwnd = win32gui.GetForegroundWindow()
-                curr_tid = win32api.GetCurrentThreadId()
-                fore_tid, _ = win32process.GetWindowThreadProcessId(foreground_hwnd)
-                target_tid, _ = win32process.GetWindowThreadProcessId(hwnd)
-
-                # 将我们的线程“附着”到前台窗口线程上，共享输入队列
-                win32process.AttachThreadInput(curr_tid, fore_tid, True)
-                if target_tid != fore_tid:
-                    win32process.AttachThreadInput(curr_tid, target_tid, True)
-
-                # 再次尝试设置前台
-                win32gui.SetForegroundWindow(hwnd)
-                win32gui.BringWindowToTop(hwnd)
-
-                # 解除附着
-                win32process.AttachThreadInput(curr_tid, fore_tid, False)
-                if target_tid != fore_tid:
-                    win32process.AttachThreadInput(curr_tid, target_tid, False)
-
-            except:
-                # 5. 最后的救命稻草：SwitchToThisWindow
-                # 这是个未公开/过时的 API，但在 Win10/11 上对顽固窗口非常有效
-                try:
-                    user32.SwitchToThisWindow(hwnd, True)
-                except:
-                    pass
+        return self.backend.switch_to_window(hwnd)
 
 
 def setup_hook(app_obj):
@@ -752,7 +1139,11 @@ if __name__ == "__main__":
     os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
     QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
 
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Task Switcher")
+    parser.add_argument("--record", metavar="PATH", help="录制会话到 trace 文件，用 replay.py 离线回放")
+    args, qt_argv = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_argv)
     app.setQuitOnLastWindowClosed(False)
 
     try:
@@ -760,7 +1151,14 @@ if __name__ == "__main__":
     except:
         pass
 
-    switcher = WindowSwitcher()
+    backend = Win32Backend()
+    if args.record:
+        # 录制真实会话，用 replay.py 离线回放
+        from replay import RecordingBackend
+        backend = RecordingBackend(backend, args.record, CONFIG.settings)
+        app.aboutToQuit.connect(backend.close)
+
+    switcher = WindowSwitcher(backend)
 
     # setup_hook(switcher)
 
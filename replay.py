@@ -0,0 +1,382 @@
+"""
+真实桌面会话的录制与回放。
+
+录制：以 `python app.py --record session.trace.gz` 启动，RecordingBackend 会把
+热键事件、窗口枚举结果、pid / 程序路径查询连同时间戳写入 gzip 压缩的 JSON Lines，
+每行是 [毫秒时间戳, 类型, 数据]。GUI 线程上的查询按处理顺序紧跟在触发它的热键之后；
+Alt 按下时后台预取的快照在另一个线程里完成，位置不固定，单独记成带预取代号的 snap。
+
+回放：`python replay.py session.trace.gz`，用 ReplayBackend 按录制顺序确定性地驱动
+WindowSwitcher（无需 Windows，可无界面运行），并输出各阶段的延迟统计（含首帧耗时），
+方便离线复现卡顿问题，或用同一份 trace 对比不同版本。
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+TRACE_VERSION = 2
+
+# 热键事件，回放时按这些事件切分
+HOTKEY_EVENTS = ("alt", "tab", "rel")
+
+
+class HotkeyRecorder(QObject):
+    """
+    热键在钩子线程里触发，但它引起的查询在 GUI 线程里执行。
+    热键记录也经由排队信号写到 GUI 线程，并且先于 WindowSwitcher 的信号投递，
+    这样 trace 里每个热键后面紧跟的就是它触发的查询，快速连按时也不会错位。
+    """
+    sig_hotkey = pyqtSignal(float, str)
+
+
+class RecordingBackend:
+    """包装真实后端，把所有调用结果写进 trace 文件"""
+
+    def __init__(self, backend, path, settings=None):
+        self.backend = backend
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()  # 键盘钩子回调在钩子线程里
+        self.started = time.perf_counter()
+        # 录制时的设置（预取时间窗口等）会影响切换器的判断，回放时要还原
+        self.write_record({"version": TRACE_VERSION, "started": time.time(), "settings": dict(settings or {})})
+
+        # 必须在 GUI 线程中创建，槽函数才会在 GUI 线程执行
+        self.hotkey_recorder = HotkeyRecorder()
+        self.hotkey_recorder.sig_hotkey.connect(self.record_hotkey)
+
+    def write_record(self, record):
+        with self.lock:
+            if self.file.closed: return
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def now(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def record(self, kind, data=None):
+        self.write_record([self.now(), kind, data])
+
+    def record_hotkey(self, t, kind):
+        # 时间戳取按键发生时（钩子线程），写入顺序按 GUI 线程的处理顺序
+        if kind == "alt":
+            # 新一轮切换开始时落一次盘，进程被强杀也只丢最后一次切换
+            with self.lock:
+                if not self.file.closed: self.file.flush()
+        self.write_record([t, kind, None])
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def install_hooks(self, on_tab, on_alt_release, on_alt_press):
+        emit = self.hotkey_recorder.sig_hotkey.emit
+
+        def record_alt(e):
+            emit(self.now(), "alt")
+            on_alt_press(e)
+
+        def record_tab():
+            emit(self.now(), "tab")
+            on_tab()
+
+        def record_release(e):
+            emit(self.now(), "rel")
+            on_alt_release(e)
+
+        self.backend.install_hooks(record_tab, record_release, record_alt)
+
+    def enum_windows(self, exclude=()):
+        windows = self.backend.enum_windows(exclude)
+        self.record("enum", [[int(hwnd), title] for hwnd, title in windows])
+        return windows
+
+    def get_window_pid(self, hwnd):
+        try:
+            pid = self.backend.get_window_pid(hwnd)
+        except Exception:
+            self.record("pid", [int(hwnd), None])
+            raise
+        self.record("pid", [int(hwnd), pid])
+        return pid
+
+    def get_process_path(self, pid):
+        try:
+            path = self.backend.get_process_path(pid)
+        except Exception:
+            self.record("exe", [pid, None])
+            raise
+        self.record("exe", [pid, path])
+        return path
+
+    def snapshot_windows(self, exclude, known_pids, tag, is_cancelled):
+        windows = self.backend.snapshot_windows(exclude, known_pids, tag, is_cancelled)
+        self.record("snap", [tag, [[int(hwnd), title, pid, path] for hwnd, title, pid, path in windows]])
+        return windows
+
+    def switch_to_window(self, hwnd):
+        self.record("act", int(hwnd))
+        return self.backend.switch_to_window(hwnd)
+
+
+def load_trace(path):
+    """返回 (录制时的设置, 事件列表)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version: {header.get('version')}")
+        return header["settings"], [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayBackend:
+    """
+    用 trace 中的数据应答 WindowSwitcher 的查询。
+
+    pid / 程序路径按参数查表而不是按调用顺序出队，
+    这样缓存策略不同的版本也能回放同一份 trace。
+    预取快照按预取代号查表，和它在文件里的位置无关。
+    录制机器上的程序路径在本机多半不存在，统一映射到 icon_file，
+    保证图标加载的开销仍然会发生。
+    """
+
+    def __init__(self, icon_file=None, snapshots=None):
+        self.icon_file = icon_file or sys.executable
+        self.snapshots = snapshots or {}  # 预取代号 -> [(hwnd, title, pid, exe_path), ...]
+        self.windows = []
+        self.pids = {}
+        self.paths = {}
+        self.activated = []
+        self.on_tab = None
+        self.on_alt_release = None
+        self.on_alt_press = None
+
+    def apply(self, kind, data):
+        """把一条非热键记录应用到当前状态"""
+        if kind == "enum":
+            self.windows = [(hwnd, title) for hwnd, title in data]
+        elif kind == "pid":
+            self.pids[data[0]] = data[1]
+        elif kind == "exe":
+            self.paths[data[0]] = data[1]
+        elif kind == "snap":
+            # 预取命中时 Tab 后不会再枚举，快照就是那一刻桌面状态的唯一记录，
+            # 关闭预取回放同一份 trace 时靠它应答
+            self.windows = [(hwnd, title) for hwnd, title, _, _ in data[1]]
+            for hwnd, _, pid, path in data[1]:
+                if pid is not None:
+                    self.pids[hwnd] = pid
+                if path is not None:
+                    self.paths[pid] = path
+
+    def install_hooks(self, on_tab, on_alt_release, on_alt_press):
+        self.on_tab = on_tab
+        self.on_alt_release = on_alt_release
+        self.on_alt_press = on_alt_press
+
+    def enum_windows(self, exclude=()):
+        exclude = {int(h) for h in exclude}
+        return [(hwnd, title) for hwnd, title in self.windows if hwnd not in exclude]
+
+    def get_window_pid(self, hwnd):
+        pid = self.pids.get(hwnd)
+        if pid is None:
+            raise LookupError(f"No pid recorded for hwnd {hwnd}")
+        return pid
+
+    def get_process_path(self, pid):
+        if self.paths.get(pid) is None:
+            raise LookupError(f"No exe path recorded for pid {pid}")
+        return self.icon_file
+
+    def snapshot_windows(self, exclude, known_pids, tag, is_cancelled):
+        if tag in self.snapshots:
+            # 录制时的路径在本机不存在，和 get_process_path 一样换成 icon_file
+            return [(hwnd, title, pid, path and self.icon_file) for hwnd, title, pid, path in self.snapshots[tag]]
+        # 回放的版本预取次数和录制时不同，只能用当前状态现拼一份
+        import app
+        return app.collect_windows(self, exclude, known_pids, is_cancelled)
+
+    def switch_to_window(self, hwnd):
+        self.activated.append(int(hwnd))
+        return any(h == int(hwnd) for h, _ in self.windows)
+
+
+class PhaseTimer:
+    """按阶段收集耗时（毫秒）"""
+
+    def __init__(self):
+        self.samples = {}
+        self.active = {}
+        self.owner = None  # 正在计时的独占阶段，期间嵌套的调用不再单独计入
+
+    def add(self, phase, ms):
+        self.samples.setdefault(phase, []).append(ms)
+
+    def wrap(self, obj, name, phase, accumulate=False, exclusive=False, when=None):
+        """
+        替换 obj 上的方法，统计每次调用耗时。
+        accumulate=True 时同一次热键处理中的多次调用会累加成一个样本（如逐个加载图标）。
+        exclusive=True 时调用内部嵌套的其它计时方法都算进这个阶段，不进它们自己的统计。
+        when(*args) 返回 False 的调用不计样本（如什么都没做就返回的回调）。
+        """
+        func = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            if self.owner is not None:
+                return func(*args, **kwargs)
+            if exclusive:
+                self.owner = phase
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                if exclusive:
+                    self.owner = None
+                if when is None or when(*args, **kwargs):
+                    if accumulate:
+                        self.active[phase] = self.active.get(phase, 0.0) + ms
+                    else:
+                        self.add(phase, ms)
+
+        setattr(obj, name, timed)
+
+    def flush(self):
+        for phase, ms in self.active.items():
+            self.add(phase, ms)
+        self.active = {}
+
+    def report(self):
+        rows = {}
+        for phase, values in self.samples.items():
+            values = sorted(values)
+            n = len(values)
+            rows[phase] = {
+                "count": n,
+                "mean": sum(values) / n,
+                "p50": values[n // 2],
+                "p95": values[min(n - 1, int(n * 0.95))],
+                "p99": values[min(n - 1, int(n * 0.99))],
+                "max": values[-1],
+            }
+        return rows
+
+
+def replay(events, settings=None, realtime=False, icon_file=None, keep_realized=False, prefetch=True):
+    """
+    回放一份 trace，返回 (阶段统计, 激活结果与录制不一致的次数, 预取计数)。
+    settings 是录制时的设置，keep_realized / prefetch 用来在回放时对比不同模式。
+    """
+    from PyQt6.QtWidgets import QApplication
+
+    import app
+
+    qapp = QApplication.instance() or QApplication(sys.argv[:1])
+    app.CONFIG.settings.update(settings or {})
+    app.CONFIG.settings["keep_realized"] = keep_realized
+    app.CONFIG.settings["speculative_prefetch"] = prefetch
+    snapshots = {data[0]: data[1] for _, kind, data in events if kind == "snap"}
+    backend = ReplayBackend(icon_file, snapshots)
+
+    # 热键时间戳取 trace 里的时间，预取是否过期的判断与录制时一致，也不受 --realtime 影响
+    trace_now = [0.0]
+    switcher = app.WindowSwitcher(backend=backend, clock=lambda: trace_now[0])
+
+    timer = PhaseTimer()
+    timer.wrap(switcher, "refresh_windows", "refresh")
+    timer.wrap(backend, "enum_windows", "enum")
+    timer.wrap(switcher, "get_window_icon", "icons", accumulate=True)
+    timer.wrap(switcher, "adjust_window_size", "layout")
+    # 预取结果在 GUI 线程上提前建列表，不在热键的关键路径上，单独记为 prefetch_build，
+    # 这样 refresh / icons / layout 和 --no-prefetch 的回放可以逐行对比
+    timer.wrap(switcher, "on_prefetch_ready", "prefetch_build", exclusive=True,
+               when=lambda generation: switcher.prefetch_ready_generation == generation)
+    switcher.sig_prefetch_ready.disconnect()
+    switcher.sig_prefetch_ready.connect(switcher.on_prefetch_ready)
+
+    recorded_acts = []
+    last_t = None
+    for i, (t, kind, data) in enumerate(events):
+        if kind == "act":
+            recorded_acts.append(data)
+            continue
+        if kind not in HOTKEY_EVENTS:
+            continue
+
+        # 先把到下一个热键为止的查询结果都装进后端，热键触发的查询就能应答
+        for _, next_kind, next_data in events[i + 1:]:
+            if next_kind in HOTKEY_EVENTS: break
+            backend.apply(next_kind, next_data)
+
+        if realtime and last_t is not None:
+            deadline = time.perf_counter() + (t - last_t) / 1000
+            while time.perf_counter() < deadline:
+                qapp.processEvents()
+        last_t = t
+        trace_now[0] = t / 1000
+
+        t0 = time.perf_counter()
+        if kind == "alt":
+            backend.on_alt_press(None)
+            # 预取在后台线程，等它跑完再继续，保证回放结果确定
+            if switcher.prefetch_future is not None:
+                switcher.prefetch_future.result()
+                timer.add("prefetch", (time.perf_counter() - t0) * 1000)
+            qapp.processEvents()
+            timer.flush()
+            continue
+        if kind == "tab":
+            phase = "next" if switcher.shown else "show"
+            backend.on_tab()
+        else:
+            phase = "activate"
+            backend.on_alt_release(None)
+        timer.add(phase, (time.perf_counter() - t0) * 1000)
+        timer.flush()
+        qapp.processEvents()
+        if phase == "show":
+            # 首帧：从热键到绘制并提交到 backing store 完成
+            timer.add("first_frame", (time.perf_counter() - t0) * 1000)
+
+    mismatches = sum(1 for a, b in zip(recorded_acts, backend.activated) if a != b)
+    mismatches += abs(len(recorded_acts) - len(backend.activated))
+    return timer.report(), mismatches, dict(switcher.prefetch_stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded Task Switcher session")
+    parser.add_argument("trace", help="app.py --record 生成的 trace 文件")
+    parser.add_argument("--realtime", action="store_true", help="按录制时的时间间隔回放（期间处理 Qt 事件）")
+    parser.add_argument("--icon-file", help="代替录制机器上程序路径的本地文件，默认用 python 可执行文件")
+    parser.add_argument("--keep-realized", action="store_true", help="开启常驻窗口模式回放，对比首帧耗时")
+    parser.add_argument("--no-prefetch", action="store_true", help="关闭 Alt 按下时的预取，对比关键路径耗时")
+    parser.add_argument("--json", help="把阶段统计写到 JSON 文件，便于对比不同版本")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtCore import qInstallMessageHandler
+    qInstallMessageHandler(lambda *_: None)
+
+    settings, events = load_trace(args.trace)
+    stats, mismatches, prefetch_stats = replay(events, settings, realtime=args.realtime, icon_file=args.icon_file,
+                                               keep_realized=args.keep_realized, prefetch=not args.no_prefetch)
+
+    print(f"{'phase':<10}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for phase, row in stats.items():
+        print(f"{phase:<10}{row['count']:>8}{row['mean']:>10.3f}{row['p50']:>10.3f}"
+              f"{row['p95']:>10.3f}{row['p99']:>10.3f}{row['max']:>10.3f}")
+    print(f"activation mismatches: {mismatches}")
+    print("prefetch: " + ", ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                                   for k, v in prefetch_stats.items()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"phases": stats, "mismatches": mismatches, "prefetch": prefetch_stats}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
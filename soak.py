@@ -0,0 +1,278 @@
+"""
+长时间运行 (soak) 测试：检测内存 / 句柄是否随运行时间缓慢增长。
+
+用假后端模拟窗口和进程不断创建、退出、改标题，反复驱动
+呼出 -> 切换 -> 激活 的完整流程，定期采样 RSS、Python 对象数、
+存活 QObject 数、系统句柄数以及各个缓存的大小，最后对采样做线性拟合，
+斜率超过阈值即以非 0 退出码失败。
+
+无需 Windows，可在 Linux CI 中无界面运行：
+    python soak.py --cycles 1000000 --sample-every 10000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import psutil
+from PyQt6.QtCore import QObject, qInstallMessageHandler
+from PyQt6.QtWidgets import QApplication
+
+import app
+
+
+class FakeBackend:
+    """
+    模拟桌面的假后端：窗口和 pid 会不断变化，
+    接口与 app.Win32Backend 保持一致。
+    """
+
+    def __init__(self, seed=0, max_windows=30, churn=0.2):
+        self.rng = random.Random(seed)
+        self.max_windows = max_windows
+        self.churn_rate = churn
+        self.exe_paths = [sys.executable, os.path.abspath(app.__file__), app.get_recourse_path("icon.png")]
+
+        self.next_hwnd = 0x10000
+        self.next_pid = 1000
+        self.windows = {}  # hwnd -> [title, pid]，插入顺序即 Z 序（后插入的在最上面）
+        self.pid_paths = {}
+        self.lock = threading.Lock()  # 预取会在后台线程里枚举
+
+        self.on_tab = None
+        self.on_alt_release = None
+        self.on_alt_press = None
+        self.activations = 0
+
+        for _ in range(max_windows // 2):
+            self.open_window()
+
+    def open_window(self, pid=None):
+        if pid is None:
+            pid = self.next_pid
+            self.next_pid += 1
+            self.pid_paths[pid] = self.rng.choice(self.exe_paths)
+        hwnd = self.next_hwnd
+        self.next_hwnd += 1
+        self.windows[hwnd] = [f"Window {hwnd:x}", pid]
+
+    def close_window(self, hwnd):
+        _, pid = self.windows.pop(hwnd)
+        if not any(p == pid for _, p in self.windows.values()):
+            del self.pid_paths[pid]
+
+    def reset(self, count):
+        """关掉所有窗口再开 count 个新进程的窗口，让每次采样都在同样规模的桌面上进行"""
+        with self.lock:
+            for hwnd in list(self.windows):
+                self.close_window(hwnd)
+            for _ in range(count):
+                self.open_window()
+
+    def churn(self):
+        """随机关闭 / 打开窗口、修改标题，pid 只增不复用"""
+        with self.lock:
+            self._churn()
+
+    def _churn(self):
+        rng = self.rng
+        if self.windows and rng.random() < self.churn_rate:
+            self.close_window(rng.choice(list(self.windows)))
+        if len(self.windows) < self.max_windows and rng.random() < self.churn_rate:
+            # 一半概率是已有进程的新窗口，一半是新进程
+            if self.windows and rng.random() < 0.5:
+                self.open_window(rng.choice(list(self.windows.values()))[1])
+            else:
+                self.open_window()
+        if self.windows and rng.random() < 0.5:
+            hwnd = rng.choice(list(self.windows))
+            self.windows[hwnd][0] = f"Window {hwnd:x} - {rng.randrange(1 << 20)}"
+
+    def install_hooks(self, on_tab, on_alt_release, on_alt_press):
+        self.on_tab = on_tab
+        self.on_alt_release = on_alt_release
+        self.on_alt_press = on_alt_press
+
+    def enum_windows(self, exclude=()):
+        exclude = {int(h) for h in exclude}
+        with self.lock:
+            return [(hwnd, title) for hwnd, (title, _) in reversed(self.windows.items()) if hwnd not in exclude]
+
+    def get_window_pid(self, hwnd):
+        with self.lock:
+            return self.windows[hwnd][1]
+
+    def get_process_path(self, pid):
+        with self.lock:
+            return self.pid_paths[pid]
+
+    def snapshot_windows(self, exclude, known_pids, tag, is_cancelled):
+        return app.collect_windows(self, exclude, known_pids, is_cancelled)
+
+    def switch_to_window(self, hwnd):
+        # 被激活的窗口移到 Z 序最上面
+        with self.lock:
+            if hwnd not in self.windows:
+                return False
+            self.windows[hwnd] = self.windows.pop(hwnd)
+        self.activations += 1
+        return True
+
+
+def cache_sizes(switcher):
+    return {
+        "icon_cache": len(switcher.icon_cache),
+        "cancelled_prefetches": len(switcher.cancelled_prefetches),
+        "pixmap_cache": len(switcher.delegate.pixmap_cache),
+        "layout_cache": len(switcher.layout_cache),
+    }
+
+
+def os_handles(process):
+    """Windows 上是内核句柄数（图标泄漏会体现在这里），其它平台是打开的文件描述符数"""
+    if sys.platform == "win32":
+        return process.num_handles()
+    return process.num_fds()
+
+
+def take_sample(cycle, switcher, process):
+    gc.collect()
+    sample = {
+        "cycle": cycle,
+        "rss": process.memory_info().rss,
+        "py_objects": len(gc.get_objects()),
+        "qobjects": len(switcher.findChildren(QObject)) + len(QApplication.allWidgets()),
+        "handles": os_handles(process),
+        # 当前窗口数量，只用于观察，不参与增长判定
+        "items": switcher.list_widget.count(),
+    }
+    sample.update(cache_sizes(switcher))
+    return sample
+
+
+def slope(xs, ys):
+    """最小二乘斜率"""
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+
+def alt_tab(backend, qapp, tabs):
+    """按下 Alt，按 tabs 次 Tab（0 次即只按 Alt），松开 Alt 激活"""
+    backend.on_alt_press(None)
+    qapp.processEvents()
+    for _ in range(tabs):
+        backend.on_tab()
+    backend.on_alt_release(None)
+    qapp.processEvents()
+
+
+def run(args):
+    # offscreen 插件不支持 activateWindow/raise，屏蔽 Qt 的重复警告
+    qInstallMessageHandler(lambda *_: None)
+    qapp = QApplication.instance() or QApplication(sys.argv[:1])
+    app.CONFIG.settings["layout_mode"] = args.layout
+    app.CONFIG.settings["keep_realized"] = args.keep_realized
+
+    backend = FakeBackend(seed=args.seed, max_windows=args.max_windows, churn=args.churn)
+    switcher = app.WindowSwitcher(backend=backend)
+    rng = random.Random(args.seed)
+    process = psutil.Process()
+
+    # 布局缓存按窗口数量分键，上限是可能出现的数量个数，先填满，避免把预热当成增长
+    for count in range(1, args.max_windows + 1):
+        switcher.window_geometry(count, switcher.target_screen)
+
+    samples = []
+    started = time.perf_counter()
+    for cycle in range(1, args.cycles + 1):
+        backend.churn()
+
+        # 按下 Alt 触发预取，偶尔只按 Alt 不按 Tab（预取被取消），
+        # 否则 Alt+Tab 呼出，再按若干次 Tab，最后松开 Alt 激活
+        alt_tab(backend, qapp, 0 if rng.random() < 0.1 else 1 + rng.randrange(4))
+
+        if cycle % args.settings_every == 0:
+            # 反复打开设置窗口，确认 open_settings 不会每次新建一个 QDialog
+            switcher.open_settings()
+            switcher.apply_settings()
+            switcher.settings_dlg.close()
+            qapp.processEvents()
+
+        if cycle % args.sample_every == 0:
+            # 窗口数和进程数是随机游走的，缓存大小和对象数会跟着变；
+            # 采样前把桌面恢复成固定规模并完整切换一次，采到的差异才只来自泄漏
+            backend.reset(args.max_windows // 2)
+            alt_tab(backend, qapp, 1)
+            sample = take_sample(cycle, switcher, process)
+            samples.append(sample)
+            print(f"[{cycle:>9}] rss={sample['rss'] / 1024 / 1024:.1f}MB "
+                  f"py_objects={sample['py_objects']} qobjects={sample['qobjects']} "
+                  f"icon_cache={sample['icon_cache']} pixmap_cache={sample['pixmap_cache']} "
+                  f"layout_cache={sample['layout_cache']} handles={sample['handles']} "
+                  f"items={sample['items']}", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"{args.cycles} cycles in {elapsed:.1f}s ({elapsed / args.cycles * 1000:.3f} ms/cycle), "
+          f"{backend.activations} activations, prefetch {switcher.prefetch_stats}")
+
+    return check_growth(samples, args)
+
+
+def check_growth(samples, args):
+    """跳过预热阶段，对剩下的采样做线性拟合，斜率单位为 每 1000 次循环 的增量"""
+    steady = samples[int(len(samples) * args.warmup):]
+    if len(steady) < 3:
+        print("Not enough samples to estimate growth, increase --cycles or lower --sample-every")
+        return 1
+
+    limits = {
+        "rss": args.max_rss_slope,
+        "py_objects": args.max_object_slope,
+        "qobjects": args.max_qobject_slope,
+        "handles": args.max_handle_slope,
+    }
+    for key in steady[0]:
+        if key not in limits and key not in ("cycle", "items"):
+            limits[key] = args.max_cache_slope
+
+    xs = [s["cycle"] / 1000 for s in steady]
+    failed = False
+    for key, limit in limits.items():
+        value = slope(xs, [s[key] for s in steady])
+        status = "OK" if value <= limit else "FAIL"
+        failed |= value > limit
+        print(f"{status:<4} {key:<12} slope={value:.3f}/1k cycles (limit {limit})")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Task Switcher soak test")
+    parser.add_argument("--cycles", type=int, default=1_000_000)
+    parser.add_argument("--sample-every", type=int, default=10_000)
+    parser.add_argument("--warmup", type=float, default=0.2, help="忽略前面这一比例的采样")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-windows", type=int, default=30)
+    parser.add_argument("--churn", type=float, default=0.2, help="每次循环窗口开关的概率")
+    parser.add_argument("--layout", choices=("grid", "list"), default="grid")
+    parser.add_argument("--settings-every", type=int, default=1000, help="每隔多少次循环打开一次设置窗口")
+    parser.add_argument("--keep-realized", action="store_true", help="开启常驻窗口模式")
+    parser.add_argument("--max-rss-slope", type=float, default=16 * 1024, help="字节 / 1k 次循环")
+    parser.add_argument("--max-object-slope", type=float, default=1.0)
+    parser.add_argument("--max-qobject-slope", type=float, default=0.0)
+    parser.add_argument("--max-handle-slope", type=float, default=0.5, help="句柄 / 文件描述符数 / 1k 次循环")
+    parser.add_argument("--max-cache-slope", type=float, default=0.5)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()